@@ -1,61 +1,323 @@
+import queue
+import shutil
+import subprocess
+import threading
+
 import cv2
 import numpy as np
 
+# Lucas-Kanade window and pyramid depth (OpenCV's calcOpticalFlowPyrLK defaults)
+LK_WIN_SIZE = (21, 21)
+LK_MAX_LEVEL = 3
+
+# Feature refill: at most this many corners, at most one per MIN_CORNER_DISTANCE cell
+MAX_CORNERS = 300
+MIN_CORNER_DISTANCE = 10
+
+# Refill only searches the cells of a COVERAGE_GRID x COVERAGE_GRID grid that have no tracked
+# feature, taking at most MAX_CORNERS_PER_CELL corners from each
+COVERAGE_GRID = 8
+MAX_CORNERS_PER_CELL = 30
+
+# Affine estimation: skip frames with too few or clustered correspondences instead of
+# letting RANSAC spend its iterations on degenerate samples
+MIN_AFFINE_POINTS = 6
+MIN_AFFINE_SPREAD = 2 * MIN_CORNER_DISTANCE  # pixels, largest extent of the point set
+
 
 class Tracker:
     def __init__(self):
-        self.tracked_features = []  # List of tracked features
+        self.tracked_features = np.empty((0, 1, 2), np.float32)  # Tracked features, shape (N, 1, 2)
         self.prev_gray = None       # Previous frame in grayscale
         self.fresh_start = True     # Flag for reset
         self.rigid_transform = np.eye(3, dtype=np.float32)  # Affine 2x3 in a 3x3 matrix
+        self.fast = cv2.FastFeatureDetector_create(threshold=25, nonmaxSuppression=True)
+
+    def coverage_cells(self, points, shape):
+        """Return the COVERAGE_GRID x COVERAGE_GRID cell (iy, ix) indices of (N, 2) points."""
+        h, w = shape[:2]
+        ix = np.clip((points[:, 0] * COVERAGE_GRID / w).astype(np.int32), 0, COVERAGE_GRID - 1)
+        iy = np.clip((points[:, 1] * COVERAGE_GRID / h).astype(np.int32), 0, COVERAGE_GRID - 1)
+        return iy, ix
+
+    def fast_corners(self, gray):
+        """Run FAST on gray; returns (N, 2) float32 points and their (N,) responses."""
+        keypoints = self.fast.detect(gray, None)
+        if not keypoints:
+            return np.empty((0, 2), np.float32), np.empty(0, np.float32)
+        points = cv2.KeyPoint_convert(keypoints)
+        responses = np.fromiter((k.response for k in keypoints), np.float32, len(keypoints))
+        return points, responses
+
+    def detect_corners(self, gray):
+        """
+        Detect FAST corners for refilling the tracker, only inside coverage cells that have
+        no tracked feature. Keeps the strongest corner per MIN_CORNER_DISTANCE cell (in place
+        of goodFeaturesToTrack's minDistance) and at most MAX_CORNERS_PER_CELL per coverage cell.
+        Returns an (N, 1, 2) float32 array or None.
+        """
+        h, w = gray.shape[:2]
+        counts = np.zeros((COVERAGE_GRID, COVERAGE_GRID), np.int32)
+        if len(self.tracked_features):
+            np.add.at(counts, self.coverage_cells(self.tracked_features[:, 0], gray.shape), 1)
+        empty = counts == 0
+        if not empty.any():
+            return None  # Coverage is already uniform, skip detection entirely
+
+        if empty.all():
+            points, responses = self.fast_corners(gray)
+            if not len(points):
+                return None
+        else:
+            # FAST scans the whole image even with a mask, so detect on ROI slices instead: one per
+            # horizontal run of empty cells in each grid row. With G = COVERAGE_GRID, pixel x lies in
+            # cell floor(x * G / w) as in coverage_cells, so cell c spans [ceil(c * w / G), ceil((c + 1) * w / G)).
+            xs = -(-np.arange(COVERAGE_GRID + 1) * w // COVERAGE_GRID)
+            ys = -(-np.arange(COVERAGE_GRID + 1) * h // COVERAGE_GRID)
+            point_chunks, response_chunks = [], []
+            for iy in range(COVERAGE_GRID):
+                ix = 0
+                while ix < COVERAGE_GRID:
+                    if not empty[iy, ix]:
+                        ix += 1
+                        continue
+                    start = ix
+                    while ix < COVERAGE_GRID and empty[iy, ix]:
+                        ix += 1
+                    x0, x1, y0, y1 = xs[start], xs[ix], ys[iy], ys[iy + 1]
+                    roi_points, roi_responses = self.fast_corners(gray[y0:y1, x0:x1])
+                    roi_points += (x0, y0)  # ROI coordinates back to frame coordinates
+                    point_chunks.append(roi_points)
+                    response_chunks.append(roi_responses)
+            points = np.concatenate(point_chunks)
+            responses = np.concatenate(response_chunks)
+            if not len(points):
+                return None
+
+        # Strongest first, so np.unique's first occurrence per cell is the best one
+        points = points[np.argsort(-responses)]
+        cells = (points // MIN_CORNER_DISTANCE).astype(np.int32)
+        _, first = np.unique(cells, axis=0, return_index=True)
+        points = points[np.sort(first)]
+
+        # Cap each coverage cell; a stable sort keeps the strongest-first order within a cell
+        iy, ix = self.coverage_cells(points, gray.shape)
+        cell_ids = iy * COVERAGE_GRID + ix
+        order = np.argsort(cell_ids, kind='stable')
+        sorted_ids = cell_ids[order]
+        starts = np.searchsorted(sorted_ids, sorted_ids, side='left')
+        keep = np.zeros(len(points), dtype=bool)
+        keep[order] = np.arange(len(points)) - starts < MAX_CORNERS_PER_CELL
+        points = points[keep][:MAX_CORNERS]
+        return points.reshape(-1, 1, 2)
 
     def process_image(self, img):
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)  # Convert frame to grayscale
-        corners = []
+        self.process_gray(gray)
 
+    def process_gray(self, gray):
+        """Track features on an already grayscale frame (e.g. the Y plane of a YUV decode)."""
         # Detect new features if less than 200 are being tracked
         if len(self.tracked_features) < 200:
-            corners = cv2.goodFeaturesToTrack(gray, maxCorners=300, qualityLevel=0.01, minDistance=10)
-            if corners is not None:
-                corners = corners.reshape(-1, 2)
-                print(f"Found {len(corners)} features")
-                self.tracked_features.extend(corners)
+            self.add_features(self.detect_corners(gray))
 
         # Perform feature tracking
-        if self.prev_gray is not None and self.tracked_features:
+        if self.prev_gray is not None and len(self.tracked_features):
             new_features, status, _ = cv2.calcOpticalFlowPyrLK(
                 self.prev_gray,
                 gray,
-                np.array(self.tracked_features, dtype=np.float32),
-                None
+                self.tracked_features,
+                None,
+                winSize=LK_WIN_SIZE,
+                maxLevel=LK_MAX_LEVEL
             )
-
-            # Filter features based on tracking status
-            valid_indices = np.where(status.flatten() == 1)[0]
-            new_features = new_features[valid_indices]
-            old_features = np.array(self.tracked_features, dtype=np.float32)[valid_indices]
-
-            # Handle catastrophic error: if too few features are tracked
-            if len(new_features) < 0.8 * len(self.tracked_features):
-                print("Catastrophic error: Resetting tracker.")
-                self.rigid_transform = np.eye(3, dtype=np.float32)
-                self.tracked_features.clear()
-                self.prev_gray = None
-                self.fresh_start = True
+            if not self.update_transform(new_features, status):
                 return
 
-            # Estimate affine transform
-            transform_matrix, _ = cv2.estimateAffinePartial2D(old_features, new_features, method=cv2.RANSAC)
-            if transform_matrix is not None:
-                transform_3x3 = np.eye(3, dtype=np.float32)
-                transform_3x3[:2] = transform_matrix  # Embed 2x3 affine transform into a 3x3 matrix
-                self.rigid_transform = self.rigid_transform @ transform_3x3
+        # Update the previous frame
+        self.prev_gray = gray
+
+    def add_features(self, corners):
+        """Append newly detected (N, 1, 2) corners to the tracked features."""
+        if corners is not None and len(corners):
+            print(f"Found {len(corners)} features")
+            self.tracked_features = np.vstack((self.tracked_features, corners))
+
+    def reset(self):
+        """Drop all tracking state after a catastrophic tracking failure."""
+        self.rigid_transform = np.eye(3, dtype=np.float32)
+        self.tracked_features = np.empty((0, 1, 2), np.float32)
+        self.prev_gray = None
+        self.fresh_start = True
+
+    def update_transform(self, new_features, status):
+        """
+        Filter the tracked features by LK status and accumulate the frame-to-frame affine.
+        Returns False if the tracker had to be reset.
+        """
+        # Filter features based on tracking status
+        valid = status[:, 0] == 1
+        new_features = new_features[valid]
+        old_features = self.tracked_features[valid]
 
-            # Update tracked features
-            self.tracked_features = [tuple(pt) for pt in new_features]
+        # Handle catastrophic error: if too few features are tracked
+        if len(new_features) < 0.8 * len(self.tracked_features):
+            print("Catastrophic error: Resetting tracker.")
+            self.reset()
+            return False
+
+        # Estimate affine transform (degeneracy is rejected once here, outside RANSAC)
+        transform_matrix = None
+        if len(old_features) >= MIN_AFFINE_POINTS and np.ptp(old_features[:, 0], axis=0).max() >= MIN_AFFINE_SPREAD:
+            transform_matrix, _ = cv2.estimateAffinePartial2D(
+                old_features, new_features, method=cv2.RANSAC,
+                maxIters=500, confidence=0.99, refineIters=5
+            )
+        if transform_matrix is not None:
+            transform_3x3 = np.eye(3, dtype=np.float32)
+            transform_3x3[:2] = transform_matrix  # Embed 2x3 affine transform into a 3x3 matrix
+            self.rigid_transform = self.rigid_transform @ transform_3x3
+
+        # Update tracked features
+        self.tracked_features = new_features
+        return True
+
+
+class CudaTracker(Tracker):
+    """
+    Same tracker running detection and optical flow on the GPU.
+    process_image takes a cv2.cuda_GpuMat so the frame is uploaded only once per frame;
+    only the (small) feature arrays cross PCIe for the CPU-side affine estimate.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.prev_gpu_gray = None   # Previous frame in grayscale, kept on the GPU
+        self.gpu_points = cv2.cuda_GpuMat()
+        self.detector = cv2.cuda.createGoodFeaturesToTrackDetector(
+            cv2.CV_8UC1, maxCorners=MAX_CORNERS, qualityLevel=0.01, minDistance=MIN_CORNER_DISTANCE
+        )
+        self.flow = cv2.cuda.SparsePyrLKOpticalFlow_create(winSize=LK_WIN_SIZE, maxLevel=LK_MAX_LEVEL)
+
+    def process_image(self, gpu_img):
+        gray = cv2.cuda.cvtColor(gpu_img, cv2.COLOR_BGR2GRAY)  # Convert frame to grayscale
+
+        # Detect new features if less than 200 are being tracked
+        if len(self.tracked_features) < 200:
+            corners = self.detector.detect(gray)
+            if not corners.empty():
+                self.add_features(corners.download().reshape(-1, 1, 2))
+
+        # Perform feature tracking (CUDA wants points as a 1xN CV_32FC2 row)
+        if self.prev_gpu_gray is not None and len(self.tracked_features):
+            self.gpu_points.upload(self.tracked_features.reshape(1, -1, 2))
+            gpu_new, gpu_status, _ = self.flow.calc(self.prev_gpu_gray, gray, self.gpu_points, None)
+            new_features = gpu_new.download().reshape(-1, 1, 2)
+            status = gpu_status.download().reshape(-1, 1)
+            if not self.update_transform(new_features, status):
+                return
 
         # Update the previous frame
-        self.prev_gray = gray
+        self.prev_gpu_gray = gray
+
+    def reset(self):
+        super().reset()
+        self.prev_gpu_gray = None
+
+
+def cuda_available():
+    """Return True if this OpenCV build has CUDA support and a usable device."""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+
+def invert_affine(transform):
+    """
+    Invert an affine transform stored in a 3x3 matrix with last row [0, 0, 1].
+    Uses the closed form [A^-1 | -A^-1 t] instead of a general 3x3 inversion and returns
+    the 2x3 matrix expected by warpAffine.
+    """
+    a, b, tx = transform[0]
+    c, d, ty = transform[1]
+    det = a * d - b * c
+    inv_a, inv_b, inv_c, inv_d = d / det, -b / det, -c / det, a / det
+    return np.array([
+        [inv_a, inv_b, -(inv_a * tx + inv_b * ty)],
+        [inv_c, inv_d, -(inv_c * tx + inv_d * ty)],
+    ], dtype=np.float32)
+
+
+def pick_h264_encoder():
+    """Use NVENC when FFmpeg was built with it and an NVIDIA driver is present, else multi-threaded x264."""
+    if shutil.which('nvidia-smi') is not None:
+        result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True)
+        if 'h264_nvenc' in result.stdout:
+            return ['-c:v', 'h264_nvenc', '-preset', 'p1']
+    return ['-c:v', 'libx264', '-preset', 'veryfast', '-threads', '0']
+
+
+class FFmpegWriter:
+    """
+    Drop-in replacement for cv2.VideoWriter that pipes raw BGR frames into an FFmpeg encoder
+    process, so encoding runs outside this process and can use NVENC or all cores.
+    """
+
+    def __init__(self, path, width, height, fps, encoder_args):
+        cmd = [
+            'ffmpeg', '-y', '-v', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', 'pipe:',
+            *encoder_args, '-pix_fmt', 'yuv420p',
+            path
+        ]
+        # About one frame of buffering: frames go straight to the pipe, and a dead encoder shows up
+        # as BrokenPipeError on the next write instead of after a large buffer fills
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, bufsize=width * height * 3)
+
+    def write(self, frame):
+        self.proc.stdin.write(np.ascontiguousarray(frame).data)
+
+    def release(self):
+        """Close the pipe and wait for FFmpeg; returns True if the encode succeeded."""
+        if not self.proc.stdin.closed:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass  # FFmpeg already exited; its return code reports the failure
+        return self.proc.wait() == 0
+
+
+def capture_frames(cap):
+    """Yield (bgr, None) frames from a cv2.VideoCapture; grayscale is left to the tracker."""
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame, None
+
+
+def decode_yuv_frames(video_path, width, height):
+    """
+    Decode frames through an FFmpeg yuv420p pipe, yielding (bgr, gray).
+    gray is the Y plane as decoded, so the tracker needs no BGR-to-gray conversion.
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-i', video_path, '-f', 'rawvideo', '-pix_fmt', 'yuv420p', 'pipe:1']
+    frame_bytes = width * height * 3 // 2
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=10**8)
+    try:
+        while True:
+            raw = proc.stdout.read(frame_bytes)
+            if len(raw) < frame_bytes:
+                return
+            yuv = np.frombuffer(raw, np.uint8).reshape(height * 3 // 2, width)
+            yield cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420), yuv[:height]
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
 
 
 def main():
@@ -75,61 +337,163 @@ def main():
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = int(cap.get(cv2.CAP_PROP_FPS))
 
-    # Define video writers
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out_with_points = cv2.VideoWriter(output_with_points, fourcc, fps, (frame_width, frame_height))
-    out_without_points = cv2.VideoWriter(output_without_points, fourcc, fps, (frame_width, frame_height))
+    # Define video writers: encode through FFmpeg when available, else fall back to OpenCV's mp4v.
+    # The FFmpeg decode/encode pipes use yuv420p, which needs even frame dimensions.
+    have_ffmpeg = shutil.which('ffmpeg') is not None
+    even_size = frame_width % 2 == 0 and frame_height % 2 == 0
+    if have_ffmpeg and even_size:
+        encoder_args = pick_h264_encoder()
+        out_with_points = FFmpegWriter(output_with_points, frame_width, frame_height, fps, encoder_args)
+        out_without_points = FFmpegWriter(output_without_points, frame_width, frame_height, fps, encoder_args)
+    else:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out_with_points = cv2.VideoWriter(output_with_points, fourcc, fps, (frame_width, frame_height))
+        out_without_points = cv2.VideoWriter(output_without_points, fourcc, fps, (frame_width, frame_height))
 
-    tracker = Tracker()
-    last_valid_frame = None  # To store the last visible frame
+    # Bounded queues between the decode, compute and encode stages
+    read_q = queue.Queue(maxsize=4)
+    write_q = queue.Queue(maxsize=4)
+    stop_event = threading.Event()
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    # Decode through FFmpeg as YUV when possible so the tracker can use the Y plane directly;
+    # otherwise fall back to cv2.VideoCapture
+    use_yuv_pipe = have_ffmpeg and even_size
+
+    def reader():
+        # Decode frames only; None signals the end of the stream
+        if use_yuv_pipe:
+            frames = decode_yuv_frames(video_path, frame_width, frame_height)
+        else:
+            frames = capture_frames(cap)
+        for item in frames:
+            if stop_event.is_set():
+                break
+            read_q.put(item)
+        frames.close()
+        read_q.put(None)
+
+    writer_errors = []
+
+    def writer():
+        # Encode both output streams until the compute stage sends None. On failure, stop the
+        # pipeline but keep draining the queue so the compute stage never blocks on put().
+        while True:
+            item = write_q.get()
+            if item is None:
+                break
+            if writer_errors:
+                continue
+            with_points, without_points = item
+            try:
+                out_with_points.write(with_points)
+                out_without_points.write(without_points)
+            except Exception as e:
+                print(f"Error: writing output video failed: {e}")
+                writer_errors.append(e)
+                stop_event.set()
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    reader_thread.start()
+    writer_thread.start()
+
+    # Keep frames on the GPU between tracking and warping when CUDA is available
+    use_cuda = cuda_available()
+    if use_cuda:
+        print("Using CUDA for tracking and warping")
+        tracker = CudaTracker()
+        gpu_frame = cv2.cuda_GpuMat()
+        gpu_stabilized = cv2.cuda_GpuMat(frame_height, frame_width, cv2.CV_8UC3)
+    else:
+        tracker = Tracker()
+
+    # Pre-allocated output buffers, used round-robin. A buffer must not be reused while the
+    # writer may still read it: up to maxsize queued frames, one held by the writer and the
+    # one being computed.
+    n_buffers = write_q.maxsize + 2
+    frame_shape = (frame_height, frame_width, 3)
+    stabilized_buffers = [np.empty(frame_shape, np.uint8) for _ in range(n_buffers)]
+    with_points_buffers = [np.empty(frame_shape, np.uint8) for _ in range(n_buffers)]
+    buffer_idx = 0
+
+    # The tracker is stateful, so the compute stage stays on the main thread
+    # (which is also where cv2.imshow has to run)
+    while not stop_event.is_set():
+        item = read_q.get()
+        if item is None:
             break
+        frame, gray = item
 
-        orig = frame.copy()  # Copy the original frame
-        tracker.process_image(orig)  # Process the frame with the tracker
-
-        # Apply the inverse of the accumulated rigid transform
-        inv_transform = np.linalg.inv(tracker.rigid_transform)
-        stabilized_frame = cv2.warpAffine(
-            frame,
-            inv_transform[:2],
-            (frame_width, frame_height),
-            flags=cv2.INTER_LINEAR,
-            borderMode=cv2.BORDER_CONSTANT,
-            borderValue=(0, 0, 0)
-        )
+        stabilized_frame = stabilized_buffers[buffer_idx]
+        frame_with_points = with_points_buffers[buffer_idx]
+        buffer_idx = (buffer_idx + 1) % n_buffers
+
+        if use_cuda:
+            gpu_frame.upload(frame)
+            tracker.process_image(gpu_frame)  # Process the frame with the tracker
 
-        # Fill black borders with the last valid frame
-        if last_valid_frame is not None:
-            mask = (stabilized_frame == 0).all(axis=2)  # Find black regions in the frame
-            stabilized_frame[mask] = last_valid_frame[mask]  # Fill with the last valid frame
+            # Apply the inverse of the accumulated rigid transform, then download once for output
+            inv_transform = invert_affine(tracker.rigid_transform)
+            cv2.cuda.warpAffine(
+                gpu_frame,
+                inv_transform,
+                (frame_width, frame_height),
+                dst=gpu_stabilized,
+                flags=cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_REPLICATE  # Fill uncovered borders with edge pixels
+            )
+            gpu_stabilized.download(stabilized_frame)
+        else:
+            # Process the frame with the tracker (read-only), reusing the decoded Y plane if present
+            if gray is not None:
+                tracker.process_gray(gray)
+            else:
+                tracker.process_image(frame)
 
-        last_valid_frame = stabilized_frame.copy()  # Update the last valid frame
+            # Apply the inverse of the accumulated rigid transform
+            inv_transform = invert_affine(tracker.rigid_transform)
+            cv2.warpAffine(
+                frame,
+                inv_transform,
+                (frame_width, frame_height),
+                dst=stabilized_frame,
+                flags=cv2.INTER_LINEAR,
+                borderMode=cv2.BORDER_REPLICATE  # Fill uncovered borders with edge pixels
+            )
 
         # Create a version with tracking points
-        frame_with_points = stabilized_frame.copy()
-        for pt in tracker.tracked_features:
-            cv2.circle(frame_with_points, tuple(map(int, pt)), 2, (0, 0, 255), -1)  #red points
+        np.copyto(frame_with_points, stabilized_frame)
+        for x, y in tracker.tracked_features.reshape(-1, 2).astype(np.int32):
+            cv2.circle(frame_with_points, (int(x), int(y)), 2, (0, 0, 255), -1)  #red points
 
         # Show the stabilized frame with tracking points
         cv2.imshow("Stabilized (With Points)", frame_with_points)
 
-        # Write both versions to their respective output files
-        out_with_points.write(frame_with_points)
-        out_without_points.write(stabilized_frame)
+        # Hand both versions to the writer thread
+        write_q.put((frame_with_points, stabilized_frame))
 
         # Break on 'ESC'
         key = cv2.waitKey(30) & 0xFF
         if key == 27:
             break
 
+    # Unblock the reader if we exited early, then flush the writer
+    stop_event.set()
+    while reader_thread.is_alive():
+        try:
+            read_q.get_nowait()
+        except queue.Empty:
+            reader_thread.join(timeout=0.1)
+    write_q.put(None)
+    writer_thread.join()
+
     cap.release()
-    out_with_points.release()
-    out_without_points.release()
+    # FFmpegWriter.release() returns False if the encoder failed; cv2.VideoWriter returns None
+    released = [out_with_points.release(), out_without_points.release()]
     cv2.destroyAllWindows()
+    if writer_errors or False in released:
+        print("Error: encoding failed, the output videos may be incomplete.")
+        return
     print(f"Videos saved as:\n - With points: {output_with_points}\n - Without points: {output_without_points}")
 
 
@@ -1,39 +1,61 @@
 import cv2
 import numpy as np
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def process_frame(frame, ref_image, ref_kp, ref_des):
+# Features are detected on images downsampled by this factor; keypoints are mapped back to full resolution
+DETECT_SCALE = 2
+
+def detect_features(detector, gray):
+    """
+    Detect ORB features on a DETECT_SCALE-times downsampled copy of a grayscale image.
+    Returns (points, descriptors) with points as a (K, 2) float32 array in full-resolution
+    pixel coordinates, or (None, None) if nothing was found.
     """
-    Given an input frame, compute its SIFT features and match them with the reference image.
+    h, w = gray.shape[:2]
+    gray_small = cv2.resize(gray, (w // DETECT_SCALE, h // DETECT_SCALE), interpolation=cv2.INTER_AREA)
+    kp, des = detector.detectAndCompute(gray_small, None)
+    if des is None:
+        return None, None
+    points = np.array([k.pt for k in kp], dtype=np.float32)
+    # Map pixel centers of the small image back onto the full-resolution grid
+    points = (points + 0.5) * DETECT_SCALE - 0.5
+    return points, des
+
+def process_frame(frame, ref_image, ref_pts, matcher, detector):
+    """
+    Given an input frame, compute its (downsampled) ORB features with the shared detector and match them with
+    the reference image using a Hamming matcher already trained on the reference descriptors.
+    ref_pts holds the reference keypoint coordinates as a (K, 2) float32 array.
     Compute the homography (from reference to frame) and invert it to warp the frame into the
     coordinate system of the reference image.
     Returns the warped frame (or None if matching fails).
     """
-    # Convert the frame to grayscale and detect SIFT features
+    # Convert the frame to grayscale and detect ORB features
     gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    sift = cv2.SIFT_create()
-    kp_frame, des_frame = sift.detectAndCompute(gray_frame, None)
+    frame_pts, des_frame = detect_features(detector, gray_frame)
     if des_frame is None:
         return None
 
-    # Use FLANN-based matcher to match descriptors between reference and frame
-    index_params = dict(algorithm=1, trees=5)  # KDTree
-    search_params = dict(checks=50)
-    flann = cv2.FlannBasedMatcher(index_params, search_params)
+    # Query the frame descriptors against the trained reference index
     try:
-        matches = flann.knnMatch(ref_des, des_frame, k=2)
+        matches = matcher.knnMatch(des_frame, k=2)
     except cv2.error as e:
-        print("FLANN matching error:", e)
+        print("Matching error:", e)
         return None
 
     # Apply Lowe's ratio test to filter good matches
-    good_matches = [m for m, n in matches if m.distance < 0.7 * n.distance]
+    good_matches = [pair[0] for pair in matches
+                    if len(pair) == 2 and pair[0].distance < 0.7 * pair[1].distance]
     if len(good_matches) < 10:
         return None
 
-    # Extract point correspondences from the good matches
-    src_pts = np.float32([ref_kp[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-    dst_pts = np.float32([kp_frame[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+    # Extract point correspondences from the good matches (train = reference, query = frame)
+    ref_idx = np.fromiter((m.trainIdx for m in good_matches), np.int32, len(good_matches))
+    frame_idx = np.fromiter((m.queryIdx for m in good_matches), np.int32, len(good_matches))
+    src_pts = ref_pts[ref_idx].reshape(-1, 1, 2)
+    dst_pts = frame_pts[frame_idx].reshape(-1, 1, 2)
 
     # Compute homography from reference image to the frame using RANSAC
     H, mask = cv2.findHomography(src_pts, dst_pts, cv2.RANSAC, 5.0)
@@ -51,11 +73,21 @@ def process_frame(frame, ref_image, ref_kp, ref_des):
     warped_frame = cv2.warpPerspective(
         frame, H_inv, (ref_w, ref_h),
         flags=cv2.INTER_LINEAR,
-        borderMode=cv2.BORDER_CONSTANT,
-        borderValue=(0, 0, 0)
+        borderMode=cv2.BORDER_REPLICATE  # Fill uncovered borders with edge pixels
     )
     return warped_frame
 
+def load_and_process(frame_path, ref_image, ref_pts, matcher, detector):
+    """
+    Load a frame from disk and stabilize it. Runs on a worker thread; the reference data,
+    detector and matcher are only read.
+    Returns (frame, stabilized) where either may be None on failure.
+    """
+    frame = cv2.imread(frame_path)
+    if frame is None:
+        return None, None
+    return frame, process_frame(frame, ref_image, ref_pts, matcher, detector)
+
 def main():
     # Prompt the user for the reference image, input folder, and output folder.
     ref_path = input("Enter the path to the reference (zoomed) image: ").strip()
@@ -71,39 +103,53 @@ def main():
         print("Error: Could not load the reference image.")
         return
 
-    # Compute SIFT features on the reference image.
+    # Compute ORB features on the reference image. The same detector is reused for every frame.
     gray_ref = cv2.cvtColor(ref_image, cv2.COLOR_BGR2GRAY)
-    sift = cv2.SIFT_create()
-    ref_kp, ref_des = sift.detectAndCompute(gray_ref, None)
+    detector = cv2.ORB_create(nfeatures=2000, fastThreshold=20)
+    ref_pts, ref_des = detect_features(detector, gray_ref)
     if ref_des is None:
         print("Error: No features detected in the reference image.")
         return
 
+    # Binary ORB descriptors are matched by Hamming distance; the reference set is added once
+    # and only the query changes per frame.
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=False)
+    matcher.add([ref_des])
+    matcher.train()
+
     # Get a sorted list of input frame filenames.
     frame_files = sorted([f for f in os.listdir(in_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-    last_valid_frame = None
 
-    for fname in frame_files:
-        frame_path = os.path.join(in_folder, fname)
-        frame = cv2.imread(frame_path)
+    # Frames are independent, so detection, matching and warping run on a thread pool
+    # (OpenCV releases the GIL). Results are consumed in input order so frames are saved and
+    # shown in sequence; only a bounded window of frames is in flight.
+    max_workers = os.cpu_count() or 1
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    file_iter = iter(frame_files)
+    pending = deque()
+
+    def submit_next():
+        fname = next(file_iter, None)
+        if fname is not None:
+            frame_path = os.path.join(in_folder, fname)
+            pending.append((fname, executor.submit(load_and_process, frame_path, ref_image, ref_pts, matcher, detector)))
+
+    for _ in range(2 * max_workers):
+        submit_next()
+
+    while pending:
+        fname, future = pending.popleft()
+        submit_next()
+
+        frame, stabilized = future.result()
         if frame is None:
             print(f"Warning: Could not load {fname}. Skipping.")
             continue
 
-        stabilized = process_frame(frame, ref_image, ref_kp, ref_des)
         if stabilized is None:
             print(f"Warning: Processing failed for {fname}. Skipping.")
             continue
 
-        # Fill black areas (resulting from the warp) with pixels from the last valid frame,
-        # if available.
-        if last_valid_frame is not None:
-            mask = (stabilized == 0).all(axis=2)
-            stabilized[mask] = last_valid_frame[mask]
-
-        # Update last valid frame with the current stabilized frame.
-        last_valid_frame = stabilized.copy()
-
         # Save the stabilized frame with the same name into the output folder.
         out_path = os.path.join(out_folder, fname)
         cv2.imwrite(out_path, stabilized)
@@ -115,6 +161,7 @@ def main():
         if key == 27:  # ESC key to exit early
             break
 
+    executor.shutdown(wait=True, cancel_futures=True)
     cv2.destroyAllWindows()
     print("Processing complete.")
 
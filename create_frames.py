@@ -1,5 +1,8 @@
 import os
+import json
+import multiprocessing
 import subprocess
+from collections import deque
 import cv2
 import numpy as np
 
@@ -14,52 +17,166 @@ def create_directories(base_path):
         os.makedirs(dir_path, exist_ok=True)
     return dirs
 
-def extract_frames(video_path, output_dir):
-    """Extract frames using FFmpeg."""
+def get_frame_size(video_path):
+    """
+    Return the displayed (width, height) of the first video stream using FFprobe. FFmpeg
+    auto-rotates on decode, so width and height are swapped for 90/270 degree rotations
+    (display matrix side data or the legacy rotate tag).
+    """
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'stream=width,height:stream_tags=rotate:stream_side_data=rotation',
+           '-of', 'json', video_path]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    stream = json.loads(output)['streams'][0]
+    width, height = int(stream['width']), int(stream['height'])
+    rotation = stream.get('tags', {}).get('rotate', 0)
+    for side_data in stream.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    if abs(int(float(rotation))) % 180 == 90:
+        width, height = height, width
+    return width, height
+
+def extract_frames(video_path):
+    """Stream frames from FFmpeg as raw BGR, yielding (filename, frame) without touching disk."""
+    width, height = get_frame_size(video_path)
+    frame_bytes = width * height * 3
     cmd = ['ffmpeg', '-i', video_path, 
            '-vf', 'fps=3',  # 3 frames per second
-           os.path.join(output_dir, 'frame_%04d.png')]
-    subprocess.run(cmd, check=True)
-
-def enhance_contrast(img):
-    """Enhance contrast of the image while preserving color."""
-    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    l = clahe.apply(l)
-    enhanced_lab = cv2.merge((l, a, b))
-    return cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
-
-def process_frames(input_dir, original_dir, enhanced_dir, edge_dir):
-    """Process frames with contrast enhancement and edge detection."""
-    for filename in sorted(os.listdir(input_dir)):
-        if filename.endswith('.png'):
-            # Read image
-            img_path = os.path.join(input_dir, filename)
-            img = cv2.imread(img_path)
-
-            # Enhance contrast while keeping color
-            enhanced_img = enhance_contrast(img)
-            
-            # Edge detection
-            img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            edges = cv2.Canny(img_gray, 100, 200)
-            edge_img = cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
-            
-            # Add frame number and timestamp
-            frame_num = filename.split('_')[1].split('.')[0]
-            timestamp_min = f"{int(float(frame_num)/5/60):02d}:{int(float(frame_num)/5%60):02d}"
-            
-            # Add white box with text
-            cv2.rectangle(edge_img, (img.shape[1]-210, 10), (img.shape[1]-10, 50), (255,255,255), -1)
-            cv2.putText(edge_img, f"Frame: {frame_num} | {timestamp_min}", 
-                        (img.shape[1]-200, 40), 
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,0), 1)
-            
-            # Save images
-            cv2.imwrite(os.path.join(original_dir, filename), img)
-            cv2.imwrite(os.path.join(enhanced_dir, filename), enhanced_img)
-            cv2.imwrite(os.path.join(edge_dir, filename), edge_img)
+           '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, bufsize=10**8)
+    try:
+        frame_idx = 1  # Same numbering as FFmpeg's frame_%04d.png pattern
+        while True:
+            raw = proc.stdout.read(frame_bytes)
+            if len(raw) < frame_bytes:
+                break
+            frame = np.frombuffer(raw, np.uint8).reshape(height, width, 3)
+            yield f'frame_{frame_idx:04d}.png', frame
+            frame_idx += 1
+        returncode = proc.wait()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+# Created once per process and reused for every frame
+_CLAHE = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
+# Per-process LAB / L-channel scratch buffers, keyed by frame shape
+_LAB_BUFFERS = {}
+
+def _get_lab_buffers(shape):
+    """Return reusable (lab_buf, l_buf) scratch buffers for frames of the given shape."""
+    if shape not in _LAB_BUFFERS:
+        _LAB_BUFFERS[shape] = (np.empty(shape, np.uint8), np.empty(shape[:2], np.uint8))
+    return _LAB_BUFFERS[shape]
+
+def enhance_contrast(img, lab_buf=None, l_buf=None):
+    """Enhance contrast of the image while preserving color.
+
+    lab_buf (HxWx3) and l_buf (HxW) are optional uint8 scratch buffers reused across calls.
+    """
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=lab_buf)
+    # Only the L channel changes: equalize it in place and write it back into the LAB image
+    l = cv2.extractChannel(lab, 0, dst=l_buf)
+    _CLAHE.apply(l, dst=l)
+    cv2.insertChannel(l, lab, 0)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+# Overlay text style for the edge frames
+_FONT = cv2.FONT_HERSHEY_SIMPLEX
+_FONT_SCALE = 0.5
+_FONT_THICKNESS = 1
+_GLYPH_PAD = 2  # Margin around each tile for strokes that overhang the advance width
+
+def _render_glyphs(texts):
+    """Pre-render each text as black-on-white tiles sharing one baseline.
+
+    Returns ({text: (tile, advance)}, ascent) where tile is a uint8 HxW image and ascent is the
+    distance from the tile's top (excluding padding) to the baseline. getTextSize's width includes
+    the stroke thickness once per call, so the pen advance is that width minus the thickness.
+    """
+    sizes = {text: cv2.getTextSize(text, _FONT, _FONT_SCALE, _FONT_THICKNESS) for text in texts}
+    ascent = max(h for (_, h), _ in sizes.values())
+    descent = max(baseline for _, baseline in sizes.values())
+    glyphs = {}
+    for text, ((width, _), _) in sizes.items():
+        tile = np.full((ascent + descent + 2 * _GLYPH_PAD, width + 2 * _GLYPH_PAD), 255, np.uint8)
+        cv2.putText(tile, text, (_GLYPH_PAD, _GLYPH_PAD + ascent), _FONT, _FONT_SCALE, 0, _FONT_THICKNESS)
+        glyphs[text] = (tile, width - _FONT_THICKNESS)
+    return glyphs, ascent
+
+_GLYPH_PREFIX = "Frame: "
+_GLYPHS, _GLYPH_ASCENT = _render_glyphs([_GLYPH_PREFIX] + list("0123456789:| "))
+
+def _draw_overlay_text(img, text, origin):
+    """Draw black text at origin (bottom-left, as in cv2.putText) by blitting the pre-rendered tiles."""
+    x, y = origin
+    if text.startswith(_GLYPH_PREFIX):
+        parts = [_GLYPH_PREFIX] + list(text[len(_GLYPH_PREFIX):])
+    else:
+        parts = list(text)
+    for part in parts:
+        if part not in _GLYPHS:
+            # No tile for this character; fall back to rasterizing it directly
+            cv2.putText(img, part, (x, y), _FONT, _FONT_SCALE, (0, 0, 0), _FONT_THICKNESS)
+            x += cv2.getTextSize(part, _FONT, _FONT_SCALE, _FONT_THICKNESS)[0][0] - _FONT_THICKNESS
+            continue
+        tile, advance = _GLYPHS[part]
+        top, left = y - _GLYPH_ASCENT - _GLYPH_PAD, x - _GLYPH_PAD
+        x += advance
+        # Clip the tile to the image like putText does (negative slice starts would wrap around)
+        y0, x0 = max(top, 0), max(left, 0)
+        y1, x1 = min(top + tile.shape[0], img.shape[0]), min(left + tile.shape[1], img.shape[1])
+        if y1 <= y0 or x1 <= x0:
+            continue
+        region = img[y0:y1, x0:x1]
+        # Black text on white: taking the minimum lets overlapping tile margins combine cleanly
+        np.minimum(region, tile[y0 - top:y1 - top, x0 - left:x1 - left, None], out=region)
+
+def _process_one(args):
+    """Enhance and edge-detect a single frame and write all three outputs (worker process)."""
+    filename, img, original_dir, enhanced_dir, edge_dir = args
+
+    # Enhance contrast while keeping color
+    enhanced_img = enhance_contrast(img, *_get_lab_buffers(img.shape))
+
+    # Edge detection (the decoded BGR frame is still needed for the other outputs, so convert
+    # it once rather than decoding the file a second time as grayscale)
+    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(img_gray, 100, 200)
+    edge_img = cv2.merge((edges, edges, edges))  # 3 channels so the overlay can be drawn
+
+    # Add frame number and timestamp
+    frame_num = filename.split('_')[1].split('.')[0]
+    timestamp_min = f"{int(float(frame_num)/5/60):02d}:{int(float(frame_num)/5%60):02d}"
+
+    # Add white box with text
+    cv2.rectangle(edge_img, (img.shape[1]-210, 10), (img.shape[1]-10, 50), (255,255,255), -1)
+    _draw_overlay_text(edge_img, f"Frame: {frame_num} | {timestamp_min}", 
+                       (img.shape[1]-200, 40))
+
+    # Save images
+    cv2.imwrite(os.path.join(original_dir, filename), img)
+    cv2.imwrite(os.path.join(enhanced_dir, filename), enhanced_img)
+    cv2.imwrite(os.path.join(edge_dir, filename), edge_img)
+
+def process_frames(frames, original_dir, enhanced_dir, edge_dir):
+    """Process (filename, frame) pairs with contrast enhancement and edge detection in worker processes."""
+    max_pending = 2 * (os.cpu_count() or 1)
+    with multiprocessing.Pool(os.cpu_count()) as pool:
+        # Frames are independent and written straight to disk, so order does not matter.
+        # Submit with a bounded window so the decoded video is never held in memory at once.
+        pending = deque()
+        for filename, img in frames:
+            if len(pending) >= max_pending:
+                pending.popleft().get()
+            pending.append(pool.apply_async(_process_one, ((filename, img, original_dir, enhanced_dir, edge_dir),)))
+        for result in pending:
+            result.get()
 
 def main():
     """Main processing function."""
@@ -70,21 +187,12 @@ def main():
     # Create directories
     dirs = create_directories(output_base_path)
     
-    # Temporary directory for initial extraction
-    temp_dir = os.path.join(output_base_path, 'temp_frames')
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    # Extract frames
-    extract_frames(video_path, temp_dir)
-    
-    # Process frames
-    process_frames(temp_dir, 
+    # Extract and process frames straight from the FFmpeg pipe
+    process_frames(extract_frames(video_path), 
                    dirs['original'], 
                    dirs['enhanced'], 
                    dirs['edges'])
     
-    # Clean up temporary directory
-    subprocess.run(['rm', '-rf', temp_dir])
     print(f"Processing complete. Frames saved to: {output_base_path}")
 
 if __name__ == "__main__":
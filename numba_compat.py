@@ -0,0 +1,13 @@
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional; without it decorated functions run as plain Python/NumPy
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit that returns the function unchanged (bare or with options)."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
@@ -1,9 +1,13 @@
 import cv2
 import os
 import csv
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+from polygon_io import dump_polygon
+
 class PolygonAnnotator:
     def __init__(self, input_folder, output_folder, csv_file="annotations.csv"):
         self.input_folder = input_folder
@@ -18,12 +22,33 @@ class PolygonAnnotator:
         self.previous_polygon = []  # Store the previous frame's polygon
         self.frame = None
         self.clone = None
+        self._base_display = None  # self.frame with the static overlays pre-drawn; None when stale
+        
+        # State of the last repaint, used to skip redundant imshow calls
+        self._last_paint_xy = (0, 0)
+        self._last_paint_time = 0.0
+        self._last_paint_magnifier = False
+        self._needs_paint = False  # Set when the cached base was drawn into directly
+        self.min_paint_move = 3           # pixels (Manhattan) the cursor must move for a repaint
+        self.min_paint_interval = 1 / 30  # seconds, caps magnifier repaints at ~30 FPS
         self.show_magnifier = False
         self.mouse_x = 0
         self.mouse_y = 0
         self.limit_y = None
         self.setting_limit = False
         
+        # Background decoding of the next frames while the current one is annotated
+        self._pool = ThreadPoolExecutor(max_workers=2)
+        self._cache = {}  # frame index -> Future of cv2.imread
+        
+        # Annotated images are encoded and written in the background; a single worker keeps
+        # writes to the same file (after going back) in order
+        self._io_pool = ThreadPoolExecutor(max_workers=1)
+        
+        # Annotated rows are buffered and written to the CSV in batches
+        self._row_buf = []
+        self.flush_every = 16
+        
     def create_magnifying_glass(self, x, y, size=200):
         """Create a magnified view of a specific region."""
         if self.frame is None:
@@ -80,6 +105,40 @@ Note: Previous frame's polygon shown in gray during annotation
 """
         print(help_text)
 
+    def prefetch_frames(self, image_files, current_idx, count=2):
+        """Start decoding the next frames in the background and drop ones behind current_idx."""
+        for idx in range(current_idx + 1, min(current_idx + 1 + count, len(image_files))):
+            if idx not in self._cache:
+                image_path = os.path.join(self.input_folder, image_files[idx])
+                self._cache[idx] = self._pool.submit(cv2.imread, image_path)
+        for idx in [i for i in self._cache if i < current_idx]:
+            self._cache.pop(idx).cancel()
+
+    def load_frame(self, image_files, idx):
+        """Return frame idx, from the prefetch cache if it was already decoded."""
+        future = self._cache.pop(idx, None)
+        if future is not None:
+            return future.result()
+        return cv2.imread(os.path.join(self.input_folder, image_files[idx]))
+
+    def flush_rows(self, writer, file):
+        """Write all buffered CSV rows and flush the file."""
+        if self._row_buf:
+            writer.writerows(self._row_buf)
+            self._row_buf.clear()
+        file.flush()
+
+    def save_image(self, output_path, image):
+        """Write an annotated image (runs on the I/O worker)."""
+        if not cv2.imwrite(output_path, image):
+            print(f"Error: could not write {output_path}")
+
+    def close(self):
+        """Stop the background prefetching and wait for pending image writes."""
+        self._cache.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._io_pool.shutdown(wait=True)
+
     def draw_limit_line(self):
         """Draw the horizontal limit line if it exists."""
         if self.limit_y is not None:
@@ -87,13 +146,11 @@ Note: Previous frame's polygon shown in gray during annotation
                     (self.frame.shape[1], self.limit_y), (0, 0, 255), 2)  # Red line
                     
     def draw_previous_polygon(self, image):
-        """Draw the previous frame's polygon in gray."""
+        """Draw the previous frame's polygon in gray (only when the cached base display is built)."""
         if len(self.previous_polygon) > 2:
-            # Draw previous polygon in gray
-            for i in range(len(self.previous_polygon) - 1):
-                cv2.line(image, self.previous_polygon[i], self.previous_polygon[i+1], (128, 128, 128), 2)
-            # Close the polygon
-            cv2.line(image, self.previous_polygon[-1], self.previous_polygon[0], (128, 128, 128), 2)
+            # Draw the closed previous polygon in gray in a single call
+            pts = np.array(self.previous_polygon, np.int32).reshape(-1, 1, 2)
+            cv2.polylines(image, [pts], True, (128, 128, 128), 2)
         
     def mouse_callback(self, event, x, y, flags, param):
         """Handle mouse events."""
@@ -108,12 +165,18 @@ Note: Previous frame's polygon shown in gray during annotation
                 self.limit_y = y
                 self.setting_limit = False
                 self.draw_limit_line()  # Draw the line immediately
+                self.invalidate_display()
                 print(f"Line set at y = {y}")
             else:
                 self.polygon.append((x, y))
-                cv2.circle(self.frame, (x, y), 3, (0, 255, 0), -1)
-                if len(self.polygon) > 1:
-                    cv2.line(self.frame, self.polygon[-2], self.polygon[-1], (255, 0, 0), 2)
+                # Draw the new vertex into the frame and, incrementally, into the cached base
+                # so the previous polygon does not have to be composited again
+                targets = [self.frame] if self._base_display is None else [self.frame, self._base_display]
+                for image in targets:
+                    cv2.circle(image, (x, y), 3, (0, 255, 0), -1)
+                    if len(self.polygon) > 1:
+                        cv2.line(image, self.polygon[-2], self.polygon[-1], (255, 0, 0), 2)
+                self._needs_paint = True
             self.update_display()
                 
         elif event == cv2.EVENT_RBUTTONDOWN:
@@ -122,34 +185,66 @@ Note: Previous frame's polygon shown in gray during annotation
                 self.frame = self.clone.copy()
                 self.draw_limit_line()  # Redraw the limit line after clearing
                 self.redraw_polygon()
+                self.invalidate_display()
                 self.update_display()
                 
+    def invalidate_display(self):
+        """Mark the cached display as stale after self.frame or the static overlays changed."""
+        self._base_display = None
+
     def update_display(self):
-        """Update the display with current frame and overlays."""
-        display = self.frame.copy()
-        
-        # Draw the previous polygon in gray
-        self.draw_previous_polygon(display)
+        """Update the display with current frame and overlays, skipping repaints that change nothing."""
+        stale = self._base_display is None
+        if not stale and not self._needs_paint and self.show_magnifier == self._last_paint_magnifier:
+            # Without the magnifier only the cached base is shown, so cursor motion changes nothing
+            if not self.show_magnifier:
+                return
+            now = time.monotonic()
+            moved = abs(self.mouse_x - self._last_paint_xy[0]) + abs(self.mouse_y - self._last_paint_xy[1])
+            if moved < self.min_paint_move or now - self._last_paint_time < self.min_paint_interval:
+                return
+        self._last_paint_xy = (self.mouse_x, self.mouse_y)
+        self._last_paint_time = time.monotonic()
+        self._last_paint_magnifier = self.show_magnifier
+        self._needs_paint = False
         
-        # Draw limit line if it exists
-        if self.limit_y is not None:
-            cv2.line(display, (0, self.limit_y), 
-                    (display.shape[1], self.limit_y), (0, 0, 255), 2)
+        # Composite the frame with the previous polygon and limit line only when something changed
+        if stale:
+            display = self.frame.copy()
+            
+            # Draw the previous polygon in gray
+            self.draw_previous_polygon(display)
+            
+            # Draw limit line if it exists
+            if self.limit_y is not None:
+                cv2.line(display, (0, self.limit_y), 
+                        (display.shape[1], self.limit_y), (0, 0, 255), 2)
+            self._base_display = display
+        display = self._base_display
         
         if self.show_magnifier:
             magnified = self.create_magnifying_glass(self.mouse_x, self.mouse_y)
             if magnified is not None:
+                # Overlay the magnifier, show, then restore just that region of the cached base
                 h, w = magnified.shape[:2]
-                display[10:10+h, -h-10:-10] = magnified
+                roi = display[10:10+h, -h-10:-10]
+                saved = roi.copy()
+                roi[:] = magnified
+                cv2.imshow("Polygon Annotation", display)
+                roi[:] = saved
+                return
                 
         cv2.imshow("Polygon Annotation", display)
                 
     def redraw_polygon(self):
         """Redraw the current polygon."""
-        for i, point in enumerate(self.polygon):
+        if not self.polygon:
+            return
+        # Open polyline for the edges, then the vertex dots on top
+        pts = np.array(self.polygon, np.int32).reshape(-1, 1, 2)
+        cv2.polylines(self.frame, [pts], False, (255, 0, 0), 2)
+        for point in self.polygon:
             cv2.circle(self.frame, point, 3, (0, 255, 0), -1)
-            if i > 0:
-                cv2.line(self.frame, self.polygon[i-1], point, (255, 0, 0), 2)
 
     def draw_text_box(self, image, text, position, font_scale=0.6, thickness=1):
         """Draw text in a white box on the image."""
@@ -190,10 +285,9 @@ Note: Previous frame's polygon shown in gray during annotation
         # Calculate height
         height = lowest[1] - highest[1]
         
-        # Close the polygon for display
-        closed_polygon = self.polygon + [self.polygon[0]]
-        for i in range(len(closed_polygon) - 1):
-            cv2.line(self.frame, closed_polygon[i], closed_polygon[i+1], (255, 0, 0), 2)
+        # Draw the closed polygon outline in one call
+        pts = np.asarray(self.polygon, dtype=np.int32).reshape(-1, 1, 2)
+        cv2.polylines(self.frame, [pts], True, (255, 0, 0), 2)
         
         # Draw height measurement in white box
         text = f"Height: {height} px"
@@ -211,101 +305,112 @@ Note: Previous frame's polygon shown in gray during annotation
         self.print_help()
         
         # Get list of image files
-        image_files = sorted([f for f in os.listdir(self.input_folder) if f.endswith(('.jpg', '.png'))])
+        with os.scandir(self.input_folder) as entries:
+            image_files = sorted(e.name for e in entries if e.name.endswith(('.jpg', '.png')) and e.is_file())
         if not image_files:
             print("No images found in input folder!")
             return
             
         # Open CSV file
-        with open(self.csv_file, mode="w", newline="") as file:
+        with open(self.csv_file, mode="w", newline="", buffering=1 << 16) as file:
             writer = csv.writer(file)
             writer.writerow(["Frame", "Height (px)", "Polygon Points"])
             
-            current_frame_idx = 0
+            # Flush buffered rows and stop the background pools however the loop exits
+            try:
+                current_frame_idx = 0
             
-            while current_frame_idx < len(image_files):
-                image_file = image_files[current_frame_idx]
-                image_path = os.path.join(self.input_folder, image_file)
+                while current_frame_idx < len(image_files):
+                    image_file = image_files[current_frame_idx]
                 
-                # Load image
-                self.frame = cv2.imread(image_path)
-                if self.frame is None:
-                    print(f"Error loading {image_file}")
-                    current_frame_idx += 1
-                    continue
+                    # Load image (usually already decoded in the background) and prefetch the next ones
+                    self.frame = self.load_frame(image_files, current_frame_idx)
+                    self.prefetch_frames(image_files, current_frame_idx)
+                    if self.frame is None:
+                        print(f"Error loading {image_file}")
+                        current_frame_idx += 1
+                        continue
                     
-                self.clone = self.frame.copy()
-                self.polygon = []
+                    self.clone = self.frame.copy()
+                    self.invalidate_display()
+                    self.polygon = []
                 
-                # Draw the limit line if it exists
-                self.draw_limit_line()
+                    # Draw the limit line if it exists
+                    self.draw_limit_line()
                 
-                # Setup window
-                cv2.namedWindow("Polygon Annotation")
-                cv2.setMouseCallback("Polygon Annotation", self.mouse_callback)
+                    # Setup window
+                    cv2.namedWindow("Polygon Annotation")
+                    cv2.setMouseCallback("Polygon Annotation", self.mouse_callback)
                 
-                print(f"\nAnnotating: {image_file} ({current_frame_idx + 1}/{len(image_files)})")
+                    print(f"\nAnnotating: {image_file} ({current_frame_idx + 1}/{len(image_files)})")
                 
-                while True:
-                    self.update_display()
-                    key = cv2.waitKey(1) & 0xFF
+                    while True:
+                        self.update_display()
+                        key = cv2.waitKey(1) & 0xFF
                     
-                    if key == 27:  # Esc key
-                        print("\nExiting...")
-                        cv2.destroyAllWindows()
-                        return
+                        if key == 27:  # Esc key
+                            print("\nExiting...")
+                            cv2.destroyAllWindows()
+                            return
                         
-                    elif key == 32:  # Space key
-                        if len(self.polygon) > 2:
-                            # Save the current polygon before calculating height
-                            self.previous_polygon = self.polygon.copy()
+                        elif key == 32:  # Space key
+                            if len(self.polygon) > 2:
+                                # Save the current polygon before calculating height
+                                self.previous_polygon = self.polygon.copy()
                             
-                            # Calculate height and save without previous polygon overlay
-                            height = self.calculate_height()
-                            closed_polygon = self.polygon + [self.polygon[0]]
-                            writer.writerow([image_file, height, closed_polygon])
+                                # Calculate height and save without previous polygon overlay
+                                height = self.calculate_height()
+                                # Stored open (no repeated first vertex); readers treat it as closed
+                                self._row_buf.append([image_file, height, dump_polygon(self.polygon)])
+                                if len(self._row_buf) >= self.flush_every:
+                                    self.flush_rows(writer, file)
                             
-                            output_path = os.path.join(self.output_folder, image_file)
-                            # Save the frame without the previous polygon overlay
-                            cv2.imwrite(output_path, self.frame)
-                            print(f"Saved annotation for {image_file}")
-                            current_frame_idx += 1
-                            break
-                        else:
-                            print("Need at least 3 points!")
+                                output_path = os.path.join(self.output_folder, image_file)
+                                # Save the frame without the previous polygon overlay; the copy guards
+                                # against later in-place drawing while the write is pending
+                                self._io_pool.submit(self.save_image, output_path, self.frame.copy())
+                                print(f"Saved annotation for {image_file}")
+                                current_frame_idx += 1
+                                break
+                            else:
+                                print("Need at least 3 points!")
                             
-                    elif key == ord('b'):  # Back to previous frame
-                        if current_frame_idx > 0:
-                            # Clear previous polygon when going back
-                            self.previous_polygon = []
-                            current_frame_idx -= 1
-                            print("Going back to previous frame")
-                            break
-                        else:
-                            print("Already at first frame")
+                        elif key == ord('b'):  # Back to previous frame
+                            if current_frame_idx > 0:
+                                # Clear previous polygon when going back
+                                self.previous_polygon = []
+                                current_frame_idx -= 1
+                                print("Going back to previous frame")
+                                break
+                            else:
+                                print("Already at first frame")
                             
-                    elif key == ord('l'):  # Set limit line
-                        self.setting_limit = True
-                        print("Click to set the horizontal line")
+                        elif key == ord('l'):  # Set limit line
+                            self.setting_limit = True
+                            print("Click to set the horizontal line")
                             
-                    elif key == ord('r'):  # Reset current frame only
-                        self.frame = self.clone.copy()
-                        self.polygon = []
-                        print("Reset current frame")
-                        # Redraw the limit line after reset
-                        self.draw_limit_line()
+                        elif key == ord('r'):  # Reset current frame only
+                            self.frame = self.clone.copy()
+                            self.polygon = []
+                            print("Reset current frame")
+                            # Redraw the limit line after reset
+                            self.draw_limit_line()
+                            self.invalidate_display()
                         
-                    elif key == ord('q'):  # Skip
-                        # Save current polygon as previous before skipping
-                        if len(self.polygon) > 2:
-                            self.previous_polygon = self.polygon.copy()
-                        print("Skipped frame")
-                        current_frame_idx += 1
-                        break
+                        elif key == ord('q'):  # Skip
+                            # Save current polygon as previous before skipping
+                            if len(self.polygon) > 2:
+                                self.previous_polygon = self.polygon.copy()
+                            print("Skipped frame")
+                            current_frame_idx += 1
+                            break
                         
-                    elif key == ord('g'):  # Toggle magnifying glass
-                        self.show_magnifier = not self.show_magnifier
-                        print(f"Magnifying glass {'enabled' if self.show_magnifier else 'disabled'}")
+                        elif key == ord('g'):  # Toggle magnifying glass
+                            self.show_magnifier = not self.show_magnifier
+                            print(f"Magnifying glass {'enabled' if self.show_magnifier else 'disabled'}")
+            finally:
+                self.flush_rows(writer, file)
+                self.close()
                         
         print(f"\nAnnotations saved to {self.csv_file}")
         cv2.destroyAllWindows()
@@ -319,9 +424,10 @@ def get_valid_path():
         path = path.strip('"\'')
         
         if os.path.exists(path):
-            # Check if directory contains any images
-            image_files = [f for f in os.listdir(path) if f.lower().endswith(('.jpg', '.png'))]
-            if image_files:
+            # Check if directory contains any images (stops at the first one found)
+            with os.scandir(path) as entries:
+                has_images = any(e.name.lower().endswith(('.jpg', '.png')) for e in entries)
+            if has_images:
                 return path
             else:
                 print("Error: No JPG or PNG files found in the specified directory.")
@@ -1,49 +1,76 @@
 #!/usr/bin/env python3
 
 import os
+import csv
 import glob
 import re
 import pandas as pd
 import numpy as np
+import matplotlib
+# Plots are only written to PNG files: use the non-interactive backend, no automatic layout pass
+matplotlib.use('Agg')
+matplotlib.rcParams['figure.autolayout'] = False
 import matplotlib.pyplot as plt
-from ast import literal_eval
+from polygon_io import load_polygon
+from numba_compat import njit
 import matplotlib.cm as cm
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+
+# Columns the polygon plots need from each CSV; the height columns are read separately
+POLYGON_COLUMNS = {'Frame', 'Polygon Points', 'Expansion_percent'}
+
+def first_polygon_lowest_y(csv_file):
+    """Return the lowest (max) y of a CSV's first polygon, reading only the header and first row."""
+    with open(csv_file, newline='') as fh:
+        reader = csv.reader(fh)
+        header = next(reader)
+        row = next(reader)
+    first_polygon = load_polygon(row[header.index('Polygon Points')])
+    return max(point[1] for point in first_polygon)
 
 def extract_polygons(csv_files, label_map):
     extracted_polygons = {}
-    global_reference_y = None
 
-    for csv_file in csv_files:
-        df = pd.read_csv(csv_file)
-        df['Polygon_Points'] = df['Polygon Points'].apply(literal_eval)
-        first_polygon = np.array(df['Polygon_Points'].iloc[0], dtype=np.float64)
-        lowest_y = np.max(first_polygon[:, 1])
-        if global_reference_y is None or lowest_y < global_reference_y:
-            global_reference_y = lowest_y
+    # The global baseline only needs each file's first polygon, so it is found without a full parse
+    global_reference_y = min(first_polygon_lowest_y(csv_file) for csv_file in csv_files)
 
+    # Each CSV is then read and parsed exactly once
     for csv_file in csv_files:
         label = label_map[os.path.basename(csv_file)]
-        df = pd.read_csv(csv_file)
-        df['Polygon_Points'] = df['Polygon Points'].apply(literal_eval)
-        df['Aligned_Polygon'] = align_polygons(df, global_reference_y)
+        df = pd.read_csv(csv_file, usecols=lambda col: col in POLYGON_COLUMNS)
+        df['Polygon_Points'] = df['Polygon Points'].apply(load_polygon)
+        df['Aligned_Polygon'] = pd.Series(align_polygons(df, global_reference_y), index=df.index, dtype=object)
         extracted_polygons[label] = df
 
     return extracted_polygons
 
+@njit(cache=True)
+def _align(points, reference_y):
+    """Center an (N, 2) polygon on x and shift it so its lowest point sits on reference_y."""
+    centroid_x = points[:, 0].mean()
+    lowest_y = points[:, 1].max()
+    aligned = points.copy()
+    aligned[:, 0] -= centroid_x
+    aligned[:, 1] -= (lowest_y - reference_y)
+    return aligned
+
 def align_polygons(df, global_reference_y):
     aligned_polygons = []
     for points in df['Polygon_Points']:
-        points = np.array(points, dtype=np.float64)
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
         if len(points) == 0:
-            aligned_polygons.append([])
+            aligned_polygons.append(points)
             continue
-        centroid_x = np.mean(points[:, 0])
-        lowest_y = np.max(points[:, 1])
-        points[:, 0] -= centroid_x
-        points[:, 1] -= (lowest_y - global_reference_y)
-        aligned_polygons.append(points.tolist())
+        aligned_polygons.append(_align(points, float(global_reference_y)))
     return aligned_polygons
 
+def close_polygon(polygon):
+    """Append the first vertex to an (N, 2) polygon for plotting, unless it is already closed."""
+    if len(polygon) > 1 and not np.array_equal(polygon[0], polygon[-1]):
+        return np.vstack([polygon, polygon[:1]])
+    return polygon
+
 def get_height_range(df):
     height_cols = [col for col in df.columns if col.startswith("Height_meters")]
     if not height_cols:
@@ -54,11 +81,13 @@ def get_height_range(df):
     return min_vals, max_vals
 
 def plot_overlayed_polygons(extracted_polygons, timestamps, output_dir, color_map):
+    # One figure is reused for every timestamp; only the axes content is rebuilt
+    fig, ax = plt.subplots(figsize=(8, 6))
     for timestamp in timestamps:
-        fig, ax = plt.subplots(figsize=(8, 6))
+        ax.clear()
         for label, df in extracted_polygons.items():
             if timestamp < len(df):
-                polygon = np.array(df.iloc[timestamp]['Aligned_Polygon'])
+                polygon = close_polygon(np.array(df.iloc[timestamp]['Aligned_Polygon']))
                 if polygon.size > 0:
                     ax.plot(polygon[:, 0], polygon[:, 1], label=label, color=color_map[label])
         ax.set_xlabel("X-Coordinate (Aligned)")
@@ -71,8 +100,8 @@ def plot_overlayed_polygons(extracted_polygons, timestamps, output_dir, color_ma
         ax.grid()
         ax.invert_yaxis()
         ax.set_aspect('equal', adjustable='datalim')
-        plt.savefig(os.path.join(output_dir, f"overlay_{timestamp}sec.png"))
-        plt.close()
+        fig.savefig(os.path.join(output_dir, f"overlay_{timestamp}sec.png"), dpi=100, bbox_inches=None)
+    plt.close(fig)
 
 def plot_expansion(extracted_polygons, output_dir, color_map):
     plt.figure(figsize=(10, 6))
@@ -83,7 +112,7 @@ def plot_expansion(extracted_polygons, output_dir, color_map):
     plt.title("Plume Expansion Over Time")
     plt.legend()
     plt.grid()
-    plt.savefig(os.path.join(output_dir, "plume_expansion.png"))
+    plt.savefig(os.path.join(output_dir, "plume_expansion.png"), dpi=100, bbox_inches=None)
     plt.close()
 
 def plot_height_ranges_and_area(extracted_polygons, raw_files, label_map, output_dir, color_map):
@@ -93,7 +122,9 @@ def plot_height_ranges_and_area(extracted_polygons, raw_files, label_map, output
     for csv_file in raw_files:
         file_name = os.path.basename(csv_file)
         label = label_map[file_name]
-        df = pd.read_csv(csv_file)
+        # Only the height and area columns are plotted here, so skip parsing the polygon strings
+        header = pd.read_csv(csv_file, nrows=0).columns
+        df = pd.read_csv(csv_file, usecols=[col for col in header if col.startswith("Height_meters") or col == 'Area'])
         min_vals, max_vals = get_height_range(df)
 
         if min_vals is not None:
@@ -117,30 +148,38 @@ def plot_height_ranges_and_area(extracted_polygons, raw_files, label_map, output
     ax2.legend()
     ax2.grid()
 
-    fig1.savefig(os.path.join(output_dir, "plume_height_ranges.png"))
-    fig2.savefig(os.path.join(output_dir, "plume_area_over_time.png"))
+    fig1.savefig(os.path.join(output_dir, "plume_height_ranges.png"), dpi=100, bbox_inches=None)
+    fig2.savefig(os.path.join(output_dir, "plume_area_over_time.png"), dpi=100, bbox_inches=None)
     plt.close(fig1)
     plt.close(fig2)
 
 def plot_every_fifth_frame(extracted_polygons, output_dir, color_map):
+    # One figure is reused for every label; only the axes content is rebuilt
+    fig, ax = plt.subplots(figsize=(8, 6))
     for label, df in extracted_polygons.items():
-        fig, ax = plt.subplots(figsize=(8, 6))
+        ax.clear()
         cmap = cm.get_cmap('coolwarm')
         total_steps = len(range(0, len(df), 5))
         colors = [cmap(i / (total_steps - 1)) for i in range(total_steps)]
+        # All outlines go into one LineCollection (a single artist) instead of one Line2D each
+        segments, segment_colors, handles = [], [], []
         for i, frame_idx in enumerate(range(0, len(df), 5)):
-            polygon = np.array(df.iloc[frame_idx]['Aligned_Polygon'])
+            polygon = close_polygon(np.array(df.iloc[frame_idx]['Aligned_Polygon']))
             if polygon.size > 0:
-                ax.plot(polygon[:, 0], polygon[:, 1], color=colors[i], label=f"t={frame_idx // 3}s")
+                segments.append(polygon)
+                segment_colors.append(colors[i])
+                handles.append(Line2D([], [], color=colors[i], label=f"t={frame_idx // 3}s"))
+        ax.add_collection(LineCollection(segments, colors=segment_colors))
+        ax.autoscale()
         ax.set_xlabel("X-Coordinate (Aligned)")
         ax.set_ylabel("Y-Coordinate (Aligned to Global Baseline)")
         ax.set_title(f"Shape Evolution for {label}")
-        ax.legend()
+        ax.legend(handles=handles)
         ax.grid()
         ax.invert_yaxis()
         ax.set_aspect('equal', adjustable='datalim')
-        plt.savefig(os.path.join(output_dir, f"shape_evolution_{label}.png"))
-        plt.close()
+        fig.savefig(os.path.join(output_dir, f"shape_evolution_{label}.png"), dpi=100, bbox_inches=None)
+    plt.close(fig)
 
 def main():
     input_folder = input("Enter the folder containing CSV files: ").strip()
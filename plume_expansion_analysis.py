@@ -1,9 +1,12 @@
 import pandas as pd
 import numpy as np
+import matplotlib
+# Plots are only written to PNG files: use the non-interactive backend, no automatic layout pass
+matplotlib.use('Agg')
+matplotlib.rcParams['figure.autolayout'] = False
 import matplotlib.pyplot as plt
-import cv2
-from ast import literal_eval
-import math
+from polygon_io import load_polygon
+from numba_compat import HAVE_NUMBA, njit, prange
 from matplotlib.ticker import MaxNLocator
 
 # Get user input for CSV file, distance, and frame height
@@ -22,64 +25,73 @@ else:
 
 # Load and process data
 df = pd.read_csv(csv_file)
-df['Polygon_Points'] = df['Polygon Points'].apply(literal_eval)
+df['Polygon_Points'] = df['Polygon Points'].apply(load_polygon)
 df['Frame_Number'] = df['Frame'].apply(lambda x: int(x.split('_')[1].split('.')[0]))
 df = df.sort_values('Frame_Number')
 
-# Initialize dictionaries
+def heights_in_meters(pixel_heights, fov_list):
+    """Convert pixel heights to meters for every FOV at once; returns an (n_frames, n_fovs) array."""
+    angle_per_pixel = np.asarray(fov_list, dtype=np.float64) / frame_height
+    theta_radians = np.deg2rad(pixel_heights[:, None] * angle_per_pixel[None, :])
+    return distance * np.tan(theta_radians)
+
+# Calculate heights
+pixel_heights = df['Height (px)'].to_numpy(dtype=np.float64)
 if shadow_exists:
-    broad_heights = {fov: [] for fov in broad_fovs}
-    shadow_heights = {fov: [] for fov in shadow_fovs}
+    broad_heights = heights_in_meters(pixel_heights, broad_fovs)
+    shadow_heights = heights_in_meters(pixel_heights, shadow_fovs)
 else:
-    heights_meters = {fov: [] for fov in fovs}
-
-areas = []
-reference_area = None
-
-# Calculate heights and areas
-for _, row in df.iterrows():
-    pixel_height = row['Height (px)']
-    
-    if shadow_exists:
-        for fov in broad_fovs:
-            angle_per_pixel = fov / frame_height
-            theta = pixel_height * angle_per_pixel
-            theta_radians = math.radians(theta)
-            height_meters = distance * math.tan(theta_radians)
-            broad_heights[fov].append(height_meters)
-        for fov in shadow_fovs:
-            angle_per_pixel = fov / frame_height
-            theta = pixel_height * angle_per_pixel
-            theta_radians = math.radians(theta)
-            height_meters = distance * math.tan(theta_radians)
-            shadow_heights[fov].append(height_meters)
-    else:
-        for fov in fovs:
-            angle_per_pixel = fov / frame_height
-            theta = pixel_height * angle_per_pixel
-            theta_radians = math.radians(theta)
-            height_meters = distance * math.tan(theta_radians)
-            heights_meters[fov].append(height_meters)
-    
-    points = np.array(row['Polygon_Points'], dtype=np.int32)
-    area = cv2.contourArea(points)
-    areas.append(area)
-    
-    if reference_area is None:
-        reference_area = area
+    heights_meters = heights_in_meters(pixel_heights, fovs)
+
+def polygon_area(points):
+    """Area of a simple polygon given as an (N, 2) array, via the shoelace formula."""
+    x = points[:, 0]
+    y = points[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+@njit(parallel=True, cache=True)
+def _csr_polygon_areas(offsets, coords):
+    """Shoelace area of polygon i = coords[offsets[i]:offsets[i+1]], one polygon per thread."""
+    n = len(offsets) - 1
+    out = np.empty(n)
+    for i in prange(n):
+        start = offsets[i]
+        end = offsets[i + 1]
+        acc = 0.0
+        for j in range(start, end):
+            k = j + 1 if j + 1 < end else start
+            acc += coords[j, 0] * coords[k, 1] - coords[k, 0] * coords[j, 1]
+        out[i] = 0.5 * abs(acc)
+    return out
+
+def polygon_areas(polygons):
+    """Areas of a list of (N, 2) polygons; uses a parallel numba kernel over a flat layout if available."""
+    # Without numba the kernel would run as slow pure Python, so loop over polygons in NumPy instead
+    if not HAVE_NUMBA or not polygons:
+        return np.array([polygon_area(points) for points in polygons])
+    # CSR-like layout: all vertices in one (M, 2) buffer, polygon i spans offsets[i]:offsets[i+1]
+    offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    np.cumsum([len(points) for points in polygons], out=offsets[1:])
+    coords = np.concatenate(polygons)
+    return _csr_polygon_areas(offsets, coords)
+
+# Calculate areas
+polygons = [np.asarray(points, dtype=np.float64).reshape(-1, 2) for points in df['Polygon_Points']]
+areas = polygon_areas(polygons)
+reference_area = areas[0]
 
 # Add results to DataFrame
 df['Area'] = areas
 df['Expansion_percent'] = ((df['Area'] - reference_area) / reference_area) * 100
 
 if shadow_exists:
-    for fov in broad_fovs:
-        df[f'Height_meters_Broad_{fov}'] = broad_heights[fov]
-    for fov in shadow_fovs:
-        df[f'Height_meters_Shadow_{fov}'] = shadow_heights[fov]
+    for i, fov in enumerate(broad_fovs):
+        df[f'Height_meters_Broad_{fov}'] = broad_heights[:, i]
+    for i, fov in enumerate(shadow_fovs):
+        df[f'Height_meters_Shadow_{fov}'] = shadow_heights[:, i]
 else:
-    for fov in fovs:
-        df[f'Height_meters_FOV_{fov}'] = heights_meters[fov]
+    for i, fov in enumerate(fovs):
+        df[f'Height_meters_FOV_{fov}'] = heights_meters[:, i]
 
 df.to_csv('processed_plume_data.csv', index=False)
 print("Processed data saved to processed_plume_data.csv")
@@ -114,7 +126,7 @@ plt.title('Plume Height Over Time for Different FOVs')
 plt.grid(True)
 plt.legend()
 plt.tight_layout()
-plt.savefig('plume_height.png')
+plt.savefig('plume_height.png', dpi=100, bbox_inches=None)
 plt.close()
 
 # Plot area over time
@@ -128,7 +140,7 @@ plt.title('Plume Area Over Time')
 plt.grid(True)
 plt.legend()
 plt.tight_layout()
-plt.savefig('plume_area.png')
+plt.savefig('plume_area.png', dpi=100, bbox_inches=None)
 plt.close()
 
 # Plot expansion over time
@@ -142,7 +154,7 @@ plt.title('Plume Expansion Over Time')
 plt.grid(True)
 plt.legend()
 plt.tight_layout()
-plt.savefig('plume_expansion.png')
+plt.savefig('plume_expansion.png', dpi=100, bbox_inches=None)
 plt.close()
 
 # Print summary
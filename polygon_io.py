@@ -0,0 +1,25 @@
+import json
+from ast import literal_eval
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dump_polygon(points):
+    """Serialize a polygon (sequence of (x, y) points) as a compact JSON list of [x, y] pairs."""
+    return json.dumps([[int(x), int(y)] for x, y in points], separators=(',', ':'))
+
+
+def load_polygon(text):
+    """
+    Parse a polygon written by dump_polygon. Uses orjson when installed, otherwise json.
+    Falls back to literal_eval for older CSVs that stored the Python repr of a list of tuples.
+    """
+    try:
+        if orjson is not None:
+            return orjson.loads(text)
+        return json.loads(text)
+    except ValueError:
+        return literal_eval(text)
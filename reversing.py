@@ -1,6 +1,9 @@
 import os
 import subprocess
 
+# Output containers that can hold an H.264 stream
+H264_CONTAINERS = (".mp4", ".mov", ".mkv", ".avi")
+
 def reverse_video(input_path):
     """
     Reverse a video using FFmpeg and save it in the same folder as the input.
@@ -16,10 +19,16 @@ def reverse_video(input_path):
     base, ext = os.path.splitext(input_path)
     output_path = f"{base}_reversed{ext}"
 
-    # Reverse the video
+    # Reverse the video (hardware decode when available, multi-threaded encode). Use the fast
+    # x264 preset only for containers that hold H.264; others keep FFmpeg's default encoder.
+    if ext.lower() in H264_CONTAINERS:
+        encoder_args = ["-c:v", "libx264", "-preset", "veryfast"]
+    else:
+        encoder_args = []
     command = [
-        "ffmpeg", "-i", input_path,
+        "ffmpeg", "-hwaccel", "auto", "-i", input_path,
         "-vf", "reverse", "-af", "areverse",
+        *encoder_args, "-threads", "0",
         output_path
     ]
 